@@ -1,49 +1,168 @@
 import time
-from web3 import Web3
+import asyncio
+from web3 import Web3, AsyncWeb3, WebsocketProviderV2
 from web3.middleware import geth_poa_middleware
+from web3.exceptions import TransactionNotFound
 import json
 import requests
+from requests.adapters import HTTPAdapter
 import logging
+from eth_abi import decode
+from hexbytes import HexBytes
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Setup web3 connection
 INFURA_URL = "https://mainnet.infura.io/v3/YOUR_INFURA_PROJECT_ID"
-w3 = Web3(Web3.HTTPProvider(INFURA_URL))
+WSS_URL = "wss://mainnet.infura.io/ws/v3/YOUR_INFURA_PROJECT_ID"
+
+# Share one keep-alive session between the web3 provider and CoinGecko
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+session.headers["Connection"] = "keep-alive"
+w3 = Web3(Web3.HTTPProvider(INFURA_URL, session=session))
 w3.middleware_onion.inject(geth_poa_middleware, layer=0)
 
 # Contract addresses
 TROVE_MANAGER_ADDRESS = "0xA39739EF8b0231DbFA0DcdA07d7e29faAbCf4bb2"
 BORROWER_OPERATIONS_ADDRESS = "0x24179CD81c9e782A4096035f7eC97fB8B783e007"
+SORTED_TROVES_ADDRESS = "0x8FdD3fbFEb32b28fb73555518f8b361bCeA741A6"
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
 
 # ABI files (you need to have these JSON files in the same directory)
 with open("TroveManager.json") as f:
     TROVE_MANAGER_ABI = json.load(f)
 with open("BorrowerOperations.json") as f:
     BORROWER_OPERATIONS_ABI = json.load(f)
+with open("SortedTroves.json") as f:
+    SORTED_TROVES_ABI = json.load(f)
+
+MULTICALL3_ABI = [{
+    "name": "aggregate3",
+    "type": "function",
+    "stateMutability": "payable",
+    "inputs": [{
+        "name": "calls",
+        "type": "tuple[]",
+        "components": [
+            {"name": "target", "type": "address"},
+            {"name": "allowFailure", "type": "bool"},
+            {"name": "callData", "type": "bytes"}
+        ]
+    }],
+    "outputs": [{
+        "name": "returnData",
+        "type": "tuple[]",
+        "components": [
+            {"name": "success", "type": "bool"},
+            {"name": "returnData", "type": "bytes"}
+        ]
+    }]
+}]
 
 # Initialize contracts
 trove_manager = w3.eth.contract(address=TROVE_MANAGER_ADDRESS, abi=TROVE_MANAGER_ABI)
 borrower_operations = w3.eth.contract(address=BORROWER_OPERATIONS_ADDRESS, abi=BORROWER_OPERATIONS_ABI)
+sorted_troves = w3.eth.contract(address=SORTED_TROVES_ADDRESS, abi=SORTED_TROVES_ABI)
+multicall = w3.eth.contract(address=MULTICALL3_ADDRESS, abi=MULTICALL3_ABI)
 
 # Your Ethereum address and private key
 YOUR_ADDRESS = "YOUR_ETHEREUM_ADDRESS"
 PRIVATE_KEY = "YOUR_PRIVATE_KEY"
 
+# Liquidation threshold and the bounds on the wait between WebSocket reconnects (in seconds)
+LIQUIDATION_THRESHOLD = 1.1
+MIN_RECONNECT_DELAY = 5
+MAX_RECONNECT_DELAY = 60
+
+# Trove events used to keep the trove window up to date between blocks. TroveManager
+# and BorrowerOperations (opening/adjusting troves) both emit TroveUpdated.
+TROVE_UPDATED_TOPIC = Web3.keccak(text="TroveUpdated(address,uint256,uint256,uint256,uint8)")
+TROVE_LIQUIDATED_TOPIC = Web3.keccak(text="TroveLiquidated(address,uint256,uint256,uint8)")
+
+# How long to wait for our liquidation to be mined before giving up on it (in seconds)
+PENDING_TX_TIMEOUT = 120
+
+# Number of lowest-CR troves to watch, and how often to re-walk the sorted list (in seconds)
+TROVE_WINDOW_SIZE = 20
+TROVE_WINDOW_TTL = 300
+
+# Cache the price for a short time
+PRICE_CACHE_TTL = 30  # seconds
+PRICE_REQUEST_TIMEOUT = 10  # seconds
+_price_cache = {"ts": 0, "value": None}
+
+# Nonce and EIP-1559 fees are kept up to date off the hot path, so sending a
+# liquidation only needs to sign and broadcast
+_tx_state = {"nonce": None, "max_fee": None, "max_priority_fee": None}
+
+# State carried between blocks. The trove window maps each watched trove to its coll/debt
+# ratio. Trove events are queued and applied between checks, so the window is never
+# changed while a check is running in the worker thread.
+_bot_state = {"pending_tx": None, "pending_tx_ts": 0, "trove_window": {}, "trove_window_ts": 0, "trove_events": [], "subscribed": False}
+
 def get_eth_price():
+    if _price_cache["value"] is not None and time.time() - _price_cache["ts"] < PRICE_CACHE_TTL:
+        return _price_cache["value"]
+    
     url = "https://api.coingecko.com/api/v3/simple/price?ids=ethereum&vs_currencies=usd"
-    response = requests.get(url)
+    response = session.get(url, timeout=PRICE_REQUEST_TIMEOUT)
     data = response.json()
-    return data["ethereum"]["usd"]
+    _price_cache["value"] = data["ethereum"]["usd"]
+    _price_cache["ts"] = time.time()
+    return _price_cache["value"]
 
-def get_trove_details(address):
-    trove = trove_manager.functions.Troves(address).call()
+def multicall_aggregate(calls):
+    # Run several view calls in a single eth_call through Multicall3. Each call is a
+    # (contract, function name, args) tuple.
+    results = multicall.functions.aggregate3(
+        [(contract.address, False, contract.encode_abi(fn_name=fn_name, args=args)) for contract, fn_name, args in calls]
+    ).call()
+
+    values = []
+    for (contract, fn_name, _), (success, return_data) in zip(calls, results):
+        # aggregate3 reverts on failure with allowFailure=False, but never decode empty return data
+        if not success:
+            raise RuntimeError(f"Multicall to {fn_name} on {contract.address} failed")
+        output_types = [output["type"] for output in contract.get_function_by_name(fn_name).abi["outputs"]]
+        decoded = decode(output_types, return_data)
+        values.append(decoded[0] if len(decoded) == 1 else decoded)
+    return values
+
+def get_trove_window(size):
+    # Walk the sorted list up from the riskiest trove. The list is ordered by nominal
+    # collateral ratio, which doesn't depend on price, so the window can be reused between polls.
+    size = min(size, sorted_troves.functions.getSize().call())
+    if size == 0:
+        return []
+    
+    window = [sorted_troves.functions.getLast().call()]
+    while len(window) < size:
+        window.append(sorted_troves.functions.getPrev(window[-1]).call())
+    return window
+
+def refresh_trove_window():
+    # Record coll/debt for each trove so trove events can be applied to the window in place
+    addresses = get_trove_window(TROVE_WINDOW_SIZE)
+    troves = multicall_aggregate([(trove_manager, "Troves", [address]) for address in addresses])
+    _bot_state["trove_window"] = {address: trove[1] / trove[0] for address, trove in zip(addresses, troves) if trove[0] > 0}
+    _bot_state["trove_window_ts"] = time.time()
+
+def get_troves(addresses, price):
+    # Fetch every trove in the window with one multicall and sort them locally by CR
+    results = multicall_aggregate([(trove_manager, "Troves", [address]) for address in addresses])
+    troves = [get_trove_details(address, trove, price) for address, trove in zip(addresses, results)]
+    return sorted((trove for trove in troves if trove), key=lambda trove: trove["collateral_ratio"])
+
+def get_trove_details(address, trove, price):
+    if trove[3] != 1:  # Closed or liquidated troves can't be liquidated
+        return None
+    
     coll = trove[1] / 1e18
     debt = trove[0] / 1e18
     
     if debt > 0:
-        price = get_eth_price()
         collateral_ratio = (coll * price) / debt
         return {
             "address": address,
@@ -53,51 +172,168 @@ def get_trove_details(address):
         }
     return None
 
+def update_fees():
+    # Median priority fee of the latest block, with headroom for the base fee to rise
+    history = w3.eth.fee_history(1, 'latest', [50])
+    next_base_fee = history['baseFeePerGas'][-1]
+    priority_fee = history['reward'][0][0]
+    _tx_state["max_priority_fee"] = priority_fee
+    _tx_state["max_fee"] = 2 * next_base_fee + priority_fee
+
 def liquidate_trove(address):
-    nonce = w3.eth.get_transaction_count(YOUR_ADDRESS)
+    if _tx_state["nonce"] is None:
+        _tx_state["nonce"] = w3.eth.get_transaction_count(YOUR_ADDRESS, 'pending')
+    if _tx_state["max_fee"] is None:
+        update_fees()
     
     txn = borrower_operations.functions.liquidateTroves([address]).build_transaction({
         'chainId': 1,
         'gas': 2000000,
-        'gasPrice': w3.eth.gas_price,
-        'nonce': nonce,
+        'maxFeePerGas': _tx_state["max_fee"],
+        'maxPriorityFeePerGas': _tx_state["max_priority_fee"],
+        'nonce': _tx_state["nonce"],
     })
     
     signed_txn = w3.eth.account.sign_transaction(txn, PRIVATE_KEY)
-    tx_hash = w3.eth.send_raw_transaction(signed_txn.rawTransaction)
+    try:
+        tx_hash = w3.eth.send_raw_transaction(signed_txn.rawTransaction)
+    except Exception:
+        _tx_state["nonce"] = None  # Resync from the node on the next attempt
+        raise
+    _tx_state["nonce"] += 1
     
     logging.info(f"Liquidation transaction sent: {tx_hash.hex()}")
     return tx_hash
 
+def handle_new_block():
+    try:
+        check_troves()
+    finally:
+        # Refresh fees for the next block after the latency-sensitive work is done. This also
+        # runs while a liquidation is pending or after a failed check, so fees never go stale.
+        update_fees()
+
+def check_troves():
+    # Don't look for new liquidations while our last one is still pending
+    if _bot_state["pending_tx"] is not None:
+        try:
+            receipt = w3.eth.get_transaction_receipt(_bot_state["pending_tx"])
+            if receipt["status"] == 1:
+                logging.info(f"Liquidation complete. Transaction hash: {_bot_state['pending_tx'].hex()}")
+            else:
+                logging.error(f"Liquidation transaction reverted: {_bot_state['pending_tx'].hex()}")
+            _bot_state["pending_tx"] = None
+        except TransactionNotFound:
+            if time.time() - _bot_state["pending_tx_ts"] < PENDING_TX_TIMEOUT:
+                logging.info("Liquidation transaction still pending. Waiting...")
+                return
+            # Assume the transaction was dropped and resync the nonce so there is no gap
+            logging.error(f"Liquidation transaction not mined after {PENDING_TX_TIMEOUT}s, giving up: {_bot_state['pending_tx'].hex()}")
+            _bot_state["pending_tx"] = None
+            _tx_state["nonce"] = None
+    
+    if not _bot_state["trove_window"]:
+        refresh_trove_window()  # Nothing to check until the sorted list has been walked once
+    
+    price = get_eth_price()
+    troves = get_troves(list(_bot_state["trove_window"]), price)
+    lowest_cr_trove = troves[0] if troves else None
+    
+    if lowest_cr_trove:
+        logging.info(f"Lowest CR Trove: {lowest_cr_trove}")
+        
+        if lowest_cr_trove['collateral_ratio'] < LIQUIDATION_THRESHOLD:
+            logging.info(f"Attempting to liquidate trove {lowest_cr_trove['address']}...")
+            _bot_state["pending_tx"] = liquidate_trove(lowest_cr_trove['address'])
+            _bot_state["pending_tx_ts"] = time.time()
+        else:
+            logging.info("Lowest CR Trove is above liquidation threshold. Waiting...")
+    else:
+        logging.info("No valid troves found. Waiting...")
+    
+    # Re-walk the sorted list after the latency-sensitive work is done
+    if time.time() - _bot_state["trove_window_ts"] > TROVE_WINDOW_TTL:
+        refresh_trove_window()
+
+def handle_trove_event(log):
+    # Apply the update to the window in place. The sorted list is ordered by coll/debt, so
+    # only a trove below the safest one in the window can belong in it.
+    borrower = Web3.to_checksum_address(HexBytes(log["topics"][1])[-20:])
+    if HexBytes(log["topics"][0]) == TROVE_LIQUIDATED_TOPIC:
+        debt = coll = 0
+    else:
+        debt, coll, _, _ = decode(["uint256", "uint256", "uint256", "uint8"], HexBytes(log["data"]))
+    
+    window = _bot_state["trove_window"]
+    others = {address: ratio for address, ratio in window.items() if address != borrower}
+    belongs = debt > 0 and (len(window) < TROVE_WINDOW_SIZE or coll / debt < max(others.values(), default=0))
+    
+    if borrower in window and not belongs:
+        # Closed, liquidated or moved out: re-walk after the next check to refill the window
+        del window[borrower]
+        _bot_state["trove_window_ts"] = 0
+    elif belongs:
+        window[borrower] = coll / debt
+        if len(window) > TROVE_WINDOW_SIZE:
+            del window[max(others, key=others.get)]  # Push the safest trove out
+
+async def process_blocks(new_block):
+    # The checks make blocking HTTP calls, so run them in a thread to keep the WebSocket
+    # serviced. Heads that arrive during a check only set the event again, so the next
+    # check runs once against the newest block instead of once per queued head.
+    loop = asyncio.get_running_loop()
+    while True:
+        await new_block.wait()
+        new_block.clear()
+        try:
+            while _bot_state["trove_events"]:
+                handle_trove_event(_bot_state["trove_events"].pop(0))
+            await loop.run_in_executor(None, handle_new_block)
+        except Exception as e:
+            logging.error(f"An error occurred: {e}")
+
+async def listen():
+    async with AsyncWeb3.persistent_websocket(WebsocketProviderV2(WSS_URL)) as ws_w3:
+        new_heads = await ws_w3.eth.subscribe('newHeads')
+        await ws_w3.eth.subscribe('logs', {
+            "address": [TROVE_MANAGER_ADDRESS, BORROWER_OPERATIONS_ADDRESS],
+            "topics": [[TROVE_UPDATED_TOPIC.hex(), TROVE_LIQUIDATED_TOPIC.hex()]]
+        })
+        logging.info("Subscribed to new blocks and trove events")
+        _bot_state["subscribed"] = True
+        # Trove events were missed while disconnected, so drop the window and any queued
+        # events: the first check after a reconnect walks the sorted list again
+        _bot_state["trove_window"] = {}
+        _bot_state["trove_window_ts"] = 0
+        _bot_state["trove_events"].clear()
+        
+        new_block = asyncio.Event()
+        worker = asyncio.create_task(process_blocks(new_block))
+        try:
+            async for response in ws_w3.ws.process_subscriptions():
+                if response["subscription"] == new_heads:
+                    new_block.set()
+                else:
+                    _bot_state["trove_events"].append(response["result"])
+        finally:
+            worker.cancel()
+
 def main():
     logging.info("Starting Liquity liquidation bot...")
     
+    reconnect_delay = MIN_RECONNECT_DELAY
     while True:
+        _bot_state["subscribed"] = False
         try:
-            first_trove = trove_manager.functions.getFirstTroveInSortedList().call()
-            lowest_cr_trove = get_trove_details(first_trove)
-            
-            if lowest_cr_trove:
-                logging.info(f"Lowest CR Trove: {lowest_cr_trove}")
-                
-                if lowest_cr_trove['collateral_ratio'] < 1.1:
-                    logging.info(f"Attempting to liquidate trove {lowest_cr_trove['address']}...")
-                    tx_hash = liquidate_trove(lowest_cr_trove['address'])
-                    
-                    # Wait for transaction confirmation
-                    w3.eth.wait_for_transaction_receipt(tx_hash)
-                    logging.info(f"Liquidation complete. Transaction hash: {tx_hash.hex()}")
-                else:
-                    logging.info("Lowest CR Trove is above liquidation threshold. Waiting...")
-            else:
-                logging.info("No valid troves found. Waiting...")
-            
-            # Short delay before next check
-            time.sleep(15)
-            
+            asyncio.run(listen())
         except Exception as e:
-            logging.error(f"An error occurred: {e}")
-            time.sleep(5)  # Short delay before retry
+            logging.error(f"WebSocket connection lost: {e}")
+        
+        # listen() never returns normally, so back off only across failed connection attempts
+        if _bot_state["subscribed"]:
+            reconnect_delay = MIN_RECONNECT_DELAY
+        time.sleep(reconnect_delay)
+        reconnect_delay = min(reconnect_delay * 2, MAX_RECONNECT_DELAY)  # Exponential backoff
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,19 +1,32 @@
 import os
-from web3 import Web3
-from web3.middleware import geth_poa_middleware
+import time
+import asyncio
+import shelve
+from web3 import AsyncWeb3, AsyncHTTPProvider
+from web3.middleware import async_geth_poa_middleware
 import json
 import requests
+from requests.adapters import HTTPAdapter
+from dataclasses import dataclass
 from datetime import datetime, timedelta
+from eth_abi import decode
 
 # Setup web3 connection
 INFURA_URL = "https://mainnet.infura.io/v3/YOUR_INFURA_PROJECT_ID"
-w3 = Web3(Web3.HTTPProvider(INFURA_URL))
-w3.middleware_onion.inject(geth_poa_middleware, layer=0)
+
+w3 = AsyncWeb3(AsyncHTTPProvider(INFURA_URL))
+w3.middleware_onion.inject(async_geth_poa_middleware, layer=0)
+
+# Keep-alive session for CoinGecko
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+session.headers["Connection"] = "keep-alive"
 
 # Contract addresses
 TROVE_MANAGER_ADDRESS = "0xA39739EF8b0231DbFA0DcdA07d7e29faAbCf4bb2"
 STABILITY_POOL_ADDRESS = "0x66017D22b0f8556afDd19FC67041899Eb65a21bb"
 LQTY_STAKING_ADDRESS = "0x4f9Fbb3f1E99B56e0Fe2892e623Ed36A76Fc605d"
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
 
 # ABI files (you need to have these JSON files in the same directory)
 with open("TroveManager.json") as f:
@@ -23,48 +36,99 @@ with open("StabilityPool.json") as f:
 with open("LQTYStaking.json") as f:
     LQTY_STAKING_ABI = json.load(f)
 
+MULTICALL3_ABI = [{
+    "name": "aggregate3",
+    "type": "function",
+    "stateMutability": "payable",
+    "inputs": [{
+        "name": "calls",
+        "type": "tuple[]",
+        "components": [
+            {"name": "target", "type": "address"},
+            {"name": "allowFailure", "type": "bool"},
+            {"name": "callData", "type": "bytes"}
+        ]
+    }],
+    "outputs": [{
+        "name": "returnData",
+        "type": "tuple[]",
+        "components": [
+            {"name": "success", "type": "bool"},
+            {"name": "returnData", "type": "bytes"}
+        ]
+    }]
+}]
+
 # Initialize contracts
 trove_manager = w3.eth.contract(address=TROVE_MANAGER_ADDRESS, abi=TROVE_MANAGER_ABI)
 stability_pool = w3.eth.contract(address=STABILITY_POOL_ADDRESS, abi=STABILITY_POOL_ABI)
 lqty_staking = w3.eth.contract(address=LQTY_STAKING_ADDRESS, abi=LQTY_STAKING_ABI)
-
-def get_trove_info(address):
-    trove = trove_manager.functions.Troves(address).call()
-    coll = trove[1] / 1e18
-    debt = trove[0] / 1e18
-    status = trove[3]
+multicall = w3.eth.contract(address=MULTICALL3_ADDRESS, abi=MULTICALL3_ABI)
+
+# Cache prices for a short time
+PRICE_CACHE_TTL = 30  # seconds
+PRICE_REQUEST_TIMEOUT = 10  # seconds
+_price_cache = {}
+
+# On-disk cache of calls pinned to a past block. Historical state never changes,
+# so entries never need to be invalidated.
+HISTORICAL_CACHE_FILE = "historical_calls.cache"
+
+@dataclass
+class LiquityPosition:
+    collateral: float
+    debt: float
+    trove_status: int
+    stability_pool_deposit: float
+    lqty_stake: float
+
+async def multicall_aggregate(calls, block_identifier='latest'):
+    # Run several view calls in a single eth_call through Multicall3. Each call is a
+    # (contract, function name, args) tuple.
+    results = await multicall.functions.aggregate3(
+        [(contract.address, False, contract.encode_abi(fn_name=fn_name, args=args)) for contract, fn_name, args in calls]
+    ).call(block_identifier=block_identifier)
+
+    values = []
+    for (contract, fn_name, _), (success, return_data) in zip(calls, results):
+        # aggregate3 reverts on failure with allowFailure=False, but never decode empty return data
+        if not success:
+            raise RuntimeError(f"Multicall to {fn_name} on {contract.address} failed")
+        output_types = [output["type"] for output in contract.get_function_by_name(fn_name).abi["outputs"]]
+        decoded = decode(output_types, return_data)
+        values.append(decoded[0] if len(decoded) == 1 else decoded)
+    return values
+
+async def fetch_all(address):
+    trove, deposit, stake = await multicall_aggregate([
+        (trove_manager, "Troves", [address]),
+        (stability_pool, "getCompoundedLUSDDeposit", [address]),
+        (lqty_staking, "stakes", [address]),
+    ])
+    return LiquityPosition(
+        collateral=trove[1] / 1e18,
+        debt=trove[0] / 1e18,
+        trove_status=trove[3],
+        stability_pool_deposit=deposit / 1e18,
+        lqty_stake=stake / 1e18
+    )
+
+def get_coingecko_price(coin_id):
+    cached = _price_cache.get(coin_id)
+    if cached is not None and time.time() - cached["ts"] < PRICE_CACHE_TTL:
+        return cached["value"]
     
-    if status == 1:  # Active trove
-        price = get_eth_price()
-        collateral_ratio = (coll * price) / debt if debt > 0 else float('inf')
-        return {
-            "collateral": coll,
-            "debt": debt,
-            "collateral_ratio": collateral_ratio,
-            "status": "Active"
-        }
-    else:
-        return {"status": "Not active"}
-
-def get_stability_pool_deposit(address):
-    deposit = stability_pool.functions.getCompoundedLUSDDeposit(address).call() / 1e18
-    return deposit
-
-def get_lqty_stake(address):
-    stake = lqty_staking.functions.stakes(address).call() / 1e18
-    return stake
+    url = f"https://api.coingecko.com/api/v3/simple/price?ids={coin_id}&vs_currencies=usd"
+    response = session.get(url, timeout=PRICE_REQUEST_TIMEOUT)
+    data = response.json()
+    _price_cache[coin_id] = {"ts": time.time(), "value": data[coin_id]["usd"]}
+    return _price_cache[coin_id]["value"]
 
 def get_eth_price():
-    url = "https://api.coingecko.com/api/v3/simple/price?ids=ethereum&vs_currencies=usd"
-    response = requests.get(url)
-    data = response.json()
-    return data["ethereum"]["usd"]
+    return get_coingecko_price("ethereum")
 
 def get_lqty_price():
-    url = "https://api.coingecko.com/api/v3/simple/price?ids=liquity&vs_currencies=usd"
-    response = requests.get(url)
-    data = response.json()
-    return data["liquity"]["usd"]
+    return get_coingecko_price("liquity")
 
 def calculate_apr(initial_balance, current_balance, days):
     if initial_balance == 0:
@@ -73,47 +137,61 @@ def calculate_apr(initial_balance, current_balance, days):
     apr = ((1 + daily_rate) ** 365) - 1
     return apr * 100
 
-def get_historical_balance(address, contract, days_ago):
-    current_block = w3.eth.get_block('latest')['number']
-    blocks_per_day = 24 * 60 * 60 / 15  # Assuming 15 seconds per block
-    past_block = int(current_block - (blocks_per_day * days_ago))
+async def get_past_block(days_ago):
+    current_block = (await w3.eth.get_block('latest'))['number']
+    blocks_per_day = int(24 * 60 * 60 / 15)  # Assuming 15 seconds per block
+    past_block = current_block - (blocks_per_day * days_ago)
+    # Round down to a whole day so repeated runs hit the historical cache
+    return past_block - past_block % blocks_per_day
+
+async def get_historical_balance(address, contract, days_ago):
+    past_block = await get_past_block(days_ago)
+    fn = contract.functions.getCompoundedLUSDDeposit(address)
+    key = f"{address}:{contract.address}:{fn.selector}:{past_block}"
     
-    past_balance = contract.functions.getCompoundedLUSDDeposit(address).call(block_identifier=past_block) / 1e18
+    with shelve.open(HISTORICAL_CACHE_FILE) as cache:
+        if key not in cache:
+            cache[key] = await fn.call(block_identifier=past_block)
+        past_balance = cache[key] / 1e18
     return past_balance
 
-def main():
+async def main():
     address = input("Enter Ethereum address: ")
-    address = Web3.to_checksum_address(address)
+    address = AsyncWeb3.to_checksum_address(address)
 
     print("\nFetching Liquity position details...\n")
 
+    # Fetch current state (one multicall) and the historical deposit concurrently
+    days_ago = 365
+    position, past_deposit = await asyncio.gather(
+        fetch_all(address),
+        get_historical_balance(address, stability_pool, days_ago)
+    )
+
     # Trove information
-    trove_info = get_trove_info(address)
-    if trove_info["status"] == "Active":
+    if position.trove_status == 1:  # Active trove
+        price = get_eth_price()
+        collateral_ratio = (position.collateral * price) / position.debt if position.debt > 0 else float('inf')
         print(f"Trove Status: Active")
-        print(f"Collateral: {trove_info['collateral']:.4f} ETH")
-        print(f"Debt: {trove_info['debt']:.4f} LUSD")
-        print(f"Collateral Ratio: {trove_info['collateral_ratio']:.2%}")
+        print(f"Collateral: {position.collateral:.4f} ETH")
+        print(f"Debt: {position.debt:.4f} LUSD")
+        print(f"Collateral Ratio: {collateral_ratio:.2%}")
     else:
         print("Trove Status: Not active")
 
     # Stability Pool
-    stability_pool_deposit = get_stability_pool_deposit(address)
-    print(f"\nStability Pool Deposit: {stability_pool_deposit:.4f} LUSD")
+    print(f"\nStability Pool Deposit: {position.stability_pool_deposit:.4f} LUSD")
 
     # Calculate Stability Pool APR
-    days_ago = 365
-    past_deposit = get_historical_balance(address, stability_pool, days_ago)
-    stability_pool_apr = calculate_apr(past_deposit, stability_pool_deposit, days_ago)
+    stability_pool_apr = calculate_apr(past_deposit, position.stability_pool_deposit, days_ago)
     print(f"Estimated Stability Pool APR (last {days_ago} days): {stability_pool_apr:.2f}%")
 
     # LQTY Staking
-    lqty_stake = get_lqty_stake(address)
     lqty_price = get_lqty_price()
-    print(f"\nLQTY Stake: {lqty_stake:.4f} LQTY (${lqty_stake * lqty_price:.2f})")
+    print(f"\nLQTY Stake: {position.lqty_stake:.4f} LQTY (${position.lqty_stake * lqty_price:.2f})")
 
     # We can't easily calculate LQTY staking APR without more complex historical data
     print("Note: LQTY staking APR calculation requires more complex historical data and is not included in this script.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
@@ -1,7 +1,10 @@
 import numpy as np
+import matplotlib
+matplotlib.use('Agg')  # Render plots to files so the simulations run without blocking on windows
 import matplotlib.pyplot as plt
 from dataclasses import dataclass
-from scipy.stats import norm
+from numba import njit, prange
+from scipy.special import ndtr
 
 @dataclass
 class UniswapPosition:
@@ -22,16 +25,17 @@ class MarketCondition:
     volatility: float
     drift: float
 
-def calculate_uniswap_value(position: UniswapPosition, current_price: float, days: int) -> float:
+def calculate_uniswap_value(position: UniswapPosition, current_price: np.ndarray, days: np.ndarray) -> np.ndarray:
+    # Works element-wise, so whole (num_paths, steps + 1) price arrays can be passed at once
     k = position.token_a_amount * position.token_b_amount
     sqrt_price = np.sqrt(current_price)
-    sqrt_initial_price = np.sqrt(position.initial_price)
+    sqrt_initial_price = position.initial_price ** 0.5  # Plain float, so float32 prices stay float32
     
     token_a = k / (sqrt_price * sqrt_initial_price)
-    token_b = k / (sqrt_price / sqrt_initial_price)
+    token_b = k * sqrt_initial_price / sqrt_price
     
     # Calculate fees earned
-    volume = k * abs(sqrt_price - sqrt_initial_price) / (sqrt_price * sqrt_initial_price)
+    volume = k * np.abs(sqrt_price - sqrt_initial_price) / (sqrt_price * sqrt_initial_price)
     fees_earned = volume * position.fee_tier * days / 365
     
     return token_a + token_b * current_price + fees_earned
@@ -39,33 +43,52 @@ def calculate_uniswap_value(position: UniswapPosition, current_price: float, day
 def black_scholes_call(S, K, T, r, sigma):
     d1 = (np.log(S / K) + (r + 0.5 * sigma ** 2) * T) / (sigma * np.sqrt(T))
     d2 = d1 - sigma * np.sqrt(T)
-    return S * norm.cdf(d1) - K * np.exp(-r * T) * norm.cdf(d2)
+    return S * ndtr(d1) - K * np.exp(-r * T) * ndtr(d2)
 
-def calculate_covered_call_value(position: CoveredCallPosition, current_price: float, days: int, r: float, sigma: float) -> float:
+def calculate_covered_call_value(position: CoveredCallPosition, current_price: np.ndarray, days: np.ndarray, r: float, sigma: float) -> np.ndarray:
     T = (position.days_to_expiration - days) / 365
-    if T <= 0:
-        return max(current_price, position.strike_price) * position.underlying_amount
     
-    call_value = black_scholes_call(current_price, position.strike_price, T, r, sigma)
-    return position.underlying_amount * current_price - position.underlying_amount * call_value + position.premium
-
-def heston_model(S0, v0, kappa, theta, sigma, rho, T, steps, num_paths):
+    # Expired steps (T <= 0) produce inf/nan here but are replaced by the payoff below
+    with np.errstate(divide='ignore', invalid='ignore'):
+        call_value = black_scholes_call(current_price, position.strike_price, T, r, sigma)
+    covered_call_value = position.underlying_amount * current_price - position.underlying_amount * call_value + position.premium
+    expired_value = np.maximum(current_price, position.strike_price) * position.underlying_amount
+    return np.where(T <= 0, expired_value, covered_call_value)
+
+def generate_normals(steps: int, num_paths: int, seed: int = None) -> np.ndarray:
+    # Antithetic pairs: the second half of the paths mirrors the first half's draws
+    half = (num_paths + 1) // 2
+    rng = np.random.Generator(np.random.SFC64(seed))
+    normals = rng.standard_normal((steps, half, 2), dtype=np.float32)
+    return np.concatenate((normals, -normals), axis=1)[:, :num_paths]
+
+@njit(parallel=True, fastmath=True, cache=True)
+def heston_model(S0, v0, kappa, theta, sigma, rho, T, normals):
+    steps, num_paths, _ = normals.shape
     dt = T / steps
-    prices = np.zeros((num_paths, steps + 1))
-    variances = np.zeros((num_paths, steps + 1))
-    prices[:, 0] = S0
-    variances[:, 0] = v0
+    sqrt_dt = np.sqrt(dt)
+    rho_complement = np.sqrt(1 - rho**2)
+    # Stored time-major, so every step reads and writes one contiguous row of paths
+    prices = np.empty((steps + 1, num_paths), dtype=normals.dtype)
+    variances = np.empty((steps + 1, num_paths), dtype=normals.dtype)
+    prices[0] = S0
+    variances[0] = v0
     
+    # Paths are independent, so each time step updates them in parallel
     for i in range(1, steps + 1):
-        dW1 = np.random.normal(0, np.sqrt(dt), num_paths)
-        dW2 = rho * dW1 + np.sqrt(1 - rho**2) * np.random.normal(0, np.sqrt(dt), num_paths)
-        
-        variances[:, i] = np.maximum(variances[:, i-1] + kappa * (theta - variances[:, i-1]) * dt + sigma * np.sqrt(variances[:, i-1]) * dW1, 0)
-        prices[:, i] = prices[:, i-1] * np.exp(np.sqrt(variances[:, i-1]) * dW2 - 0.5 * variances[:, i-1] * dt)
+        for j in prange(num_paths):
+            v = variances[i-1, j]
+            sqrt_v = np.sqrt(v)
+            dW1 = normals[i-1, j, 0] * sqrt_dt
+            dW2 = rho * dW1 + rho_complement * normals[i-1, j, 1] * sqrt_dt
+            
+            variances[i, j] = max(v + kappa * (theta - v) * dt + sigma * sqrt_v * dW1, 0.0)
+            prices[i, j] = prices[i-1, j] * np.exp(sqrt_v * dW2 - 0.5 * v * dt)
     
-    return prices, variances
+    # Callers expect (num_paths, steps + 1), the transpose is a view and costs no copy
+    return prices.T, variances.T
 
-def simulate_prices(initial_price: float, market_condition: MarketCondition, days: int, num_simulations: int) -> np.ndarray:
+def simulate_prices(initial_price: float, market_condition: MarketCondition, days: int, normals: np.ndarray) -> np.ndarray:
     # Use Heston model for more sophisticated price simulation
     v0 = market_condition.volatility ** 2
     kappa = 2  # Mean reversion speed
@@ -73,23 +96,30 @@ def simulate_prices(initial_price: float, market_condition: MarketCondition, day
     sigma = 0.5  # Volatility of volatility
     rho = -0.7  # Correlation between asset returns and variance
     
-    prices, _ = heston_model(initial_price, v0, kappa, theta, sigma, rho, days/365, days, num_simulations)
+    prices, _ = heston_model(initial_price, v0, kappa, theta, sigma, rho, days/365, normals)
     return prices
 
 def calculate_metrics(values: np.ndarray, initial_investment: float) -> dict:
     returns = (values[:, -1] - initial_investment) / initial_investment
+    mean_return = np.mean(returns)
+    std_dev = np.std(returns)
+    downside_std = np.std(returns[returns < 0])
+    
+    # Drawdown is measured along each path, against that path's running peak
+    running_max = np.maximum.accumulate(values, axis=1)
     return {
-        "mean_return": np.mean(returns),
-        "std_dev": np.std(returns),
-        "max_drawdown": np.max((np.maximum.accumulate(values) - values) / np.maximum.accumulate(values)),
-        "sharpe_ratio": np.mean(returns) / np.std(returns) if np.std(returns) != 0 else 0,
-        "sortino_ratio": np.mean(returns) / np.std(returns[returns < 0]) if np.std(returns[returns < 0]) != 0 else 0
+        "mean_return": mean_return,
+        "std_dev": std_dev,
+        "max_drawdown": 1 - np.min(values / running_max),
+        "sharpe_ratio": mean_return / std_dev if std_dev != 0 else 0,
+        "sortino_ratio": mean_return / downside_std if downside_std != 0 else 0
     }
 
 # Simulation parameters
 initial_price = 100
 days = 30
 num_simulations = 10000
+random_seed = 42  # Set to None for a different draw on every run
 
 # Market conditions
 bull_market = MarketCondition(volatility=0.2, drift=0.1)
@@ -112,15 +142,17 @@ option_exit_cost = 20
 # Risk-free rate
 risk_free_rate = 0.02
 
-for market_condition, market_name in zip(market_conditions, market_names):
-    print(f"\n{market_name} Market Simulation:")
-    
+initial_investment = uniswap_position.token_a_amount + uniswap_position.token_b_amount * initial_price
+day_grid = np.arange(days + 1, dtype=np.float32)
+
+def run_market(market_condition: MarketCondition, market_name: str, normals: np.ndarray):
     # Simulate prices
-    price_paths = simulate_prices(initial_price, market_condition, days, num_simulations)
+    price_paths = simulate_prices(initial_price, market_condition, days, normals)
 
-    # Calculate values for both strategies
-    uniswap_values = np.apply_along_axis(lambda x: [calculate_uniswap_value(uniswap_position, price, i) for i, price in enumerate(x)], 1, price_paths)
-    covered_call_values = np.apply_along_axis(lambda x: [calculate_covered_call_value(covered_call_position, price, i, risk_free_rate, market_condition.volatility) for i, price in enumerate(x)], 1, price_paths)
+    # Calculate values for both strategies. Uniswap values are around 1e8, where a float32
+    # step is 8 USD, so costs and returns are computed on float64 copies.
+    uniswap_values = calculate_uniswap_value(uniswap_position, price_paths, day_grid).astype(np.float64)
+    covered_call_values = calculate_covered_call_value(covered_call_position, price_paths, day_grid, risk_free_rate, market_condition.volatility).astype(np.float64)
 
     # Apply transaction costs and gas fees
     uniswap_values -= uniswap_entry_cost
@@ -129,19 +161,9 @@ for market_condition, market_name in zip(market_conditions, market_names):
     covered_call_values[:, -1] -= option_exit_cost
 
     # Calculate metrics
-    initial_investment = uniswap_position.token_a_amount + uniswap_position.token_b_amount * initial_price
     uniswap_metrics = calculate_metrics(uniswap_values, initial_investment)
     covered_call_metrics = calculate_metrics(covered_call_values, initial_investment)
 
-    # Print results
-    print("\nUniswap LP Metrics:")
-    for key, value in uniswap_metrics.items():
-        print(f"{key}: {value:.4f}")
-
-    print("\nCovered Call Metrics:")
-    for key, value in covered_call_metrics.items():
-        print(f"{key}: {value:.4f}")
-
     # Visualize results
     plt.figure(figsize=(12, 6))
     plt.plot(np.mean(uniswap_values, axis=0), label="Uniswap LP")
@@ -150,7 +172,8 @@ for market_condition, market_name in zip(market_conditions, market_names):
     plt.ylabel("Value")
     plt.title(f"Average Value over Time - {market_name} Market")
     plt.legend()
-    plt.show()
+    plt.savefig(f"{market_name}_avg.png")
+    plt.close()
 
     plt.figure(figsize=(12, 6))
     plt.hist(uniswap_values[:, -1], bins=50, alpha=0.5, label="Uniswap LP")
@@ -159,26 +182,57 @@ for market_condition, market_name in zip(market_conditions, market_names):
     plt.ylabel("Frequency")
     plt.title(f"Distribution of Final Values - {market_name} Market")
     plt.legend()
-    plt.show()
+    plt.savefig(f"{market_name}_distribution.png")
+    plt.close()
+
+    return uniswap_metrics, covered_call_metrics, uniswap_values[:, -1], covered_call_values[:, -1]
 
 # Compare with another DeFi strategy: Aave lending
 def calculate_aave_value(initial_amount: float, apy: float, days: int) -> float:
     return initial_amount * (1 + apy) ** (days / 365)
 
-aave_apy = 0.05  # 5% APY
-aave_values = np.array([calculate_aave_value(initial_investment, aave_apy, days) for _ in range(num_simulations)])
-
-print("\nAave Lending Metrics:")
-aave_metrics = calculate_metrics(aave_values.reshape(-1, 1), initial_investment)
-for key, value in aave_metrics.items():
-    print(f"{key}: {value:.4f}")
-
-plt.figure(figsize=(12, 6))
-plt.hist(uniswap_values[:, -1], bins=50, alpha=0.5, label="Uniswap LP")
-plt.hist(covered_call_values[:, -1], bins=50, alpha=0.5, label="Covered Call")
-plt.hist(aave_values, bins=50, alpha=0.5, label="Aave Lending")
-plt.xlabel("Final Value")
-plt.ylabel("Frequency")
-plt.title("Distribution of Final Values - All Strategies")
-plt.legend()
-plt.show()
\ No newline at end of file
+def main():
+    # Common random numbers: every market condition is simulated from the same draws.
+    # Paths are kept in float32, which is plenty of precision for a 30-day simulation.
+    normals = generate_normals(days, num_simulations, random_seed)
+
+    # Markets run one after another. heston_model already spreads the paths over every core
+    # with prange, so that is the only level of parallelism.
+    results = [run_market(market_condition, market_name, normals) for market_condition, market_name in zip(market_conditions, market_names)]
+
+    for market_name, (uniswap_metrics, covered_call_metrics, _, _) in zip(market_names, results):
+        print(f"\n{market_name} Market Simulation:")
+
+        # Print results
+        print("\nUniswap LP Metrics:")
+        for key, value in uniswap_metrics.items():
+            print(f"{key}: {value:.4f}")
+
+        print("\nCovered Call Metrics:")
+        for key, value in covered_call_metrics.items():
+            print(f"{key}: {value:.4f}")
+
+    aave_apy = 0.05  # 5% APY
+    aave_values = np.array([calculate_aave_value(initial_investment, aave_apy, days) for _ in range(num_simulations)])
+
+    print("\nAave Lending Metrics:")
+    aave_metrics = calculate_metrics(aave_values.reshape(-1, 1), initial_investment)
+    for key, value in aave_metrics.items():
+        print(f"{key}: {value:.4f}")
+
+    # Compared against the final values of the last market simulated
+    _, _, uniswap_final_values, covered_call_final_values = results[-1]
+
+    plt.figure(figsize=(12, 6))
+    plt.hist(uniswap_final_values, bins=50, alpha=0.5, label="Uniswap LP")
+    plt.hist(covered_call_final_values, bins=50, alpha=0.5, label="Covered Call")
+    plt.hist(aave_values, bins=50, alpha=0.5, label="Aave Lending")
+    plt.xlabel("Final Value")
+    plt.ylabel("Frequency")
+    plt.title("Distribution of Final Values - All Strategies")
+    plt.legend()
+    plt.savefig("All_distribution.png")
+    plt.close()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1,5 +1,5 @@
 import numpy as np
-from scipy.stats import norm
+from scipy.special import ndtr
 from dataclasses import dataclass
 
 @dataclass
@@ -9,6 +9,9 @@ class UniswapPosition:
     price: float    # Current price of token B in terms of token A
     fee_tier: float # Fee tier (e.g., 0.003 for 0.3%)
 
+def norm_pdf(x):
+    return np.exp(-0.5 * x * x) / np.sqrt(2 * np.pi)
+
 def calculate_uniswap_option_risks(position: UniswapPosition, days: int, risk_free_rate: float, volatility: float):
     # Calculate the constant product k
     k = position.token_a * position.token_b
@@ -20,15 +23,21 @@ def calculate_uniswap_option_risks(position: UniswapPosition, days: int, risk_fr
     T = days / 365
 
     # Calculate d1 and d2 for Black-Scholes
-    d1 = (np.log(position.price / strike) + (risk_free_rate + 0.5 * volatility**2) * T) / (volatility * np.sqrt(T))
-    d2 = d1 - volatility * np.sqrt(T)
+    sqrt_T = np.sqrt(T)
+    d1 = (np.log(position.price / strike) + (risk_free_rate + 0.5 * volatility**2) * T) / (volatility * sqrt_T)
+    d2 = d1 - volatility * sqrt_T
+
+    # Terms shared by several Greeks
+    pdf_d1 = norm_pdf(d1)
+    discount = np.exp(-risk_free_rate * T)
+    cdf_minus_d2 = ndtr(-d2)
 
     # Calculate option Greeks
-    delta = norm.cdf(d1) - 1
-    gamma = norm.pdf(d1) / (position.price * volatility * np.sqrt(T))
-    vega = position.price * norm.pdf(d1) * np.sqrt(T) / 100  # Divided by 100 for percentage move
-    theta = (-position.price * norm.pdf(d1) * volatility / (2 * np.sqrt(T)) 
-             - risk_free_rate * strike * np.exp(-risk_free_rate * T) * norm.cdf(-d2)) / 365  # Daily theta
+    delta = ndtr(d1) - 1
+    gamma = pdf_d1 / (position.price * volatility * sqrt_T)
+    vega = position.price * pdf_d1 * sqrt_T / 100  # Divided by 100 for percentage move
+    theta = (-position.price * pdf_d1 * volatility / (2 * sqrt_T) 
+             - risk_free_rate * strike * discount * cdf_minus_d2) / 365  # Daily theta
 
     # Adjust for Uniswap position size
     position_value = position.token_a + position.token_b * position.price